@@ -1,4 +1,4 @@
-import os, sys, tempfile, json, shutil, argparse, glob, logging
+import os, sys, tempfile, json, shutil, argparse, glob, logging, hashlib
 from enum import Enum
 from subprocess import Popen, PIPE
 from datetime import datetime, timedelta
@@ -15,6 +15,9 @@ MAX_FONTSIZE = 99
 MAX_LOG_LENGTH = 2048           # Maximum length of an entry of logging
 MEMORY_PARA = 4                 # Coefficient to decide the capture method to call
 MAX_COMMAND_LENGTH = 20000      # Maximum length of the command for the system to run
+DEDUP_BLOCK_SIZE = 64 * 1024    # Size of each block sampled when fingerprinting a file
+DEDUP_SAMPLES = 8               # Number of blocks sampled when fingerprinting a file
+CACHE_SIZE = 1024               # Default size limit of the frame cache (in MB)
 REQUIRED_FILTERS = {
     "scale",
     "drawtext",
@@ -25,6 +28,7 @@ REQUIRED_FILTERS = {
     "select",
     "trim",
 }
+PROBE_KEYS = {'avg_frame_rate', 'width', 'height', 'duration', 'size'}
 VIDEO_EXT = {'.mp4', '.mkv', '.avi', '.mov', '.wmv', '.m4v', '.flv', '.rmvb', '.rm', '.ts', '.m2ts'}
 FFMPEG = None
 FFPROBE = None
@@ -63,6 +67,11 @@ file_h = RotatingFileHandler(
 file_h.setFormatter(logging.Formatter(file_fmt))
 LOGGER.addHandler(file_h)
 
+if os.name == 'nt':
+    CACHE_DIR = os.path.join(os.environ.get('LOCALAPPDATA', os.path.expanduser('~')), 'batchcap', 'cache')
+else:
+    CACHE_DIR = os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')), 'batchcap')
+
 # build parser
 def build_parser():
     parser = argparse.ArgumentParser()
@@ -78,6 +87,9 @@ def build_parser():
     parser.add_argument('-i', '--timestamp',action='store_true',                help='add timestamp on the thumbnail')
     parser.add_argument('-o', '--overwrite',action='store_true',                help='overwrite existing files')
     parser.add_argument('-v', '--verbose',  action='store_true',                help='verbose output')
+    parser.add_argument('-k', '--cache',    action='store_true',                help='cache extracted frames for later re-layouts (slower first capture)')
+    parser.add_argument('-d', '--cachedir', type=str,       default=CACHE_DIR,  help='directory of the frame cache')
+    parser.add_argument('-z', '--cachesize',type=float,     default=CACHE_SIZE, help='size limit of the frame cache (in MB)')
 
     return parser
 
@@ -140,8 +152,25 @@ def run_async(
 
     return retcode, out, err
 
-def probe_file(file:str) -> dict | None:
-    '''Returns basic information of a video.'''
+def probe_file(file:str, cache_dir:str | None = None) -> dict | None:
+    '''Returns basic information of a video.
+    The result is read from and saved to the cache if cache_dir is specified.
+    '''
+    if cache_dir:
+        cached = get_cache_name(cache_dir, file, 'probe') + '.json'
+        if os.path.isfile(cached):
+            try:
+                with open(cached, encoding='utf-8') as f:
+                    info = json.load(f)
+                if not isinstance(info, dict) or not PROBE_KEYS <= info.keys():
+                    raise ValueError('incomplete entry')
+                os.utime(cached)
+                return info
+            except (OSError, ValueError) as e:
+                LOGGER.warning(f'Ignoring broken cache entry {cached}: {e}')
+                if os.path.exists(cached):
+                    os.remove(cached)
+
     cmd = [FFPROBE, '-show_format', '-show_streams', '-loglevel', 'error', '-of', 'json', file]
     
     ret_code, out, err = run_async(cmd)
@@ -161,7 +190,54 @@ def probe_file(file:str) -> dict | None:
     width, height = int(video_info['width']), int(video_info['height'])
     duration = float(probe['format']['duration'])
     size = float(probe['format']['size'])
-    return {'avg_frame_rate': frame_rate, 'width': width, 'height': height, 'duration': duration, 'size': size}
+    info = {'avg_frame_rate': frame_rate, 'width': width, 'height': height, 'duration': duration, 'size': size}
+    if cache_dir:
+        with open(cached + '.part', 'w', encoding='utf-8') as f:
+            json.dump(info, f)
+        os.replace(cached + '.part', cached)
+    return info
+
+def get_cache_name(cache_dir:str, file:str, *key) -> str:
+    '''Get the path (without extension) of a cache entry of a file.
+    The entry is keyed on the path, size and modification time of the file plus the given key, 
+    so it is invalidated when the file changes.
+    '''
+    stat = os.stat(file)
+    name = '|'.join(map(str, (os.path.abspath(file), stat.st_size, stat.st_mtime_ns, *key)))
+    return os.path.join(cache_dir, hashlib.blake2b(name.encode(), digest_size=16).hexdigest())
+
+def prune_cache(cache_dir:str, max_size:float) -> None:
+    '''Evict the least recently used entries until the cache is no larger than max_size (in bytes).
+    Entries are touched when used, so their modification time is the time of last use.
+    Only the entries named by get_cache_name are considered, so other files in the directory 
+    and the frames still being written ('.part') are left alone.
+    '''
+    entries = []
+    with os.scandir(cache_dir) as it:
+        for entry in it:
+            stem, ext = os.path.splitext(entry.name)
+            if ext not in ('.png', '.json') or len(stem) != 32 or stem.strip('0123456789abcdef'):
+                continue
+            try:
+                if not entry.is_file():
+                    continue
+                stat = entry.stat()
+            except FileNotFoundError:
+                # Evicted by another process.
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+    
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_size:
+            break
+        try:
+            os.remove(path)
+            total -= size
+        except FileNotFoundError:
+            total -= size
+        except OSError as e:
+            LOGGER.warning(f'Failed to evict cache entry {path}: {e}')
 
 def suppress_log(message:str, max_length=MAX_LOG_LENGTH) -> str:
     '''Suppress logging output in case the content is too long.'''
@@ -181,6 +257,49 @@ def escape_chars(text, chars, escape='\\') -> str:
         text = text.replace(ch, escape + ch)
     return text
 
+def get_timestamp(t:float) -> str:
+    '''Format a timestamp as H:MM:SS.mmm, escaped for drawtext.'''
+    h, m, s = str(timedelta(seconds=t)).split(':')
+    t = f'{h}:{m}:{float(s):.3f}'
+    return escape_chars(t, r"\'=:", r'\\')
+
+def stack_filter(inputs:list[str], args, capture_info:dict, scale=False) -> str:
+    '''Get the filter that stacks the tiles into the output sheet labelled [c].
+    
+    Each tile is scaled (if scale is True, converting to RGBA in the same scaler pass) and 
+    gets its timestamp in a single chain, so the timestamp is cut off at the edge of its tile. 
+    The tiles are then laid out by xstack with the gaps between them filled transparent, and 
+    the outer padding is added once to the sheet instead of to every tile.
+    '''
+    seek = capture_info['seek']
+    interval = capture_info['interval']
+    width, height = capture_info['width'], capture_info['height']
+    c, r = capture_info['columns'], capture_info['rows']
+    pad = capture_info['pad']
+    fontsize = capture_info['fontsize']
+    fontfile = escape_chars(FONTFILE, r"\' =:", r'\\')
+    
+    tiles, labels = [], []
+    for k, label in enumerate(inputs):
+        chain = []
+        if scale:
+            chain.append(f'scale=-1:{args.height},format=rgba')
+        if args.timestamp:
+            chain.append(f'drawtext=fontcolor={args.fontcolor}:fontfile={fontfile}:\
+fontsize={fontsize}:text={get_timestamp(seek + k*interval)}:x=text_h:y=text_h')
+        if chain:
+            tiles.append(f'{label}{",".join(chain)}[v{k}];')
+            label = f'[v{k}]'
+        labels.append(label)
+    
+    graph = (''.join(tiles) + ''.join(labels)
+             + f'xstack=inputs={c * r}:layout='
+             + '|'.join([f'{i * (width + 2 * pad)}_{j * (height + 2 * pad)}' for j in range(r) for i in range(c)])
+             + ':fill=#00000000')
+    if pad > 0:
+        graph += f',pad=iw+2*{pad}:ih+2*{pad}:{pad}:{pad}:color=#00000000'
+    return graph + '[c]'
+
 def capture_file_once_cmd(file:str, args, capture_info:dict) -> list:
     r'''Get the command to capture a video according to arguments.
     
@@ -191,18 +310,20 @@ def capture_file_once_cmd(file:str, args, capture_info:dict) -> list:
         '-ss', '10.0', '-i', 'video.mkv', 
         '-ss', '133.86', '-i', 'video.mkv', 
         '-filter_complex', 
-            '[0:v:0]scale=-1:270[a0];[a0]drawtext=fontcolor=yellow:fontfile=C\\\\:/Windows/Fonts/arial.ttf:\
-                fontsize=20:text=0\\\\:00\\\\:10:x=text_h:y=text_h[v0];
-            [1:v:0]scale=-1:270[a1];[a1]drawtext=fontcolor=yellow:fontfile=C\\\\:/Windows/Fonts/arial.ttf:\
-                fontsize=20:text=0\\\\:02\\\\:13.860000:x=text_h:y=text_h[v1];
-            [v0][v1]xstack=inputs=2:layout=0_0.0|270_0.0[c]', 
+            '[0:v:0]scale=-1:270,format=rgba,drawtext=fontcolor=yellow:fontfile=C\\\\:/Windows/Fonts/arial.ttf:\
+                fontsize=20:text=0\\\\:00\\\\:10.000:x=text_h:y=text_h[v0];
+            [1:v:0]scale=-1:270,format=rgba,drawtext=fontcolor=yellow:fontfile=C\\\\:/Windows/Fonts/arial.ttf:\
+                fontsize=20:text=0\\\\:02\\\\:13.860:x=text_h:y=text_h[v1];
+            [v0][v1]xstack=inputs=2:layout=0_0|484_0:fill=#00000000,pad=iw+2*2:ih+2*2:2:2:color=#00000000[c]', 
         '-map', '[c]', 
         '-frames:v', '1', 
         '-loglevel', 'error', 
         'video_cap.png', 
         '-y']
     
-    Some of the arguments, like the 'text=0\\\\:00\\\\:10' is calculated in the code.
+    Some of the arguments, like the 'text=0\\\\:00\\\\:10.000' is calculated in the code.
+    Each tile is scaled, converted to RGBA and timestamped in one chain, and the gaps and 
+    the outer padding are added to the stacked sheet (see stack_filter).
     
     Another way to do this is:
     
@@ -221,10 +342,7 @@ def capture_file_once_cmd(file:str, args, capture_info:dict) -> list:
     output_name = capture_info['output_name']
     seek = capture_info['seek']
     interval = capture_info['interval']
-    width, height = capture_info['width'], capture_info['height']
     c, r = capture_info['columns'], capture_info['rows']
-    pad = capture_info['pad']
-    fontsize = capture_info['fontsize']
     
     # Generating command
     cmd = [FFMPEG]
@@ -232,29 +350,7 @@ def capture_file_once_cmd(file:str, args, capture_info:dict) -> list:
         cmd.extend(['-ss', f'{seek + i*interval}', '-i', file])
     
     cmd.append('-filter_complex')
-    if args.timestamp:
-        fontfile = escape_chars(FONTFILE, r"\' =:", r'\\')
-        def get_timestamp(t):
-            h, m, s = str(timedelta(seconds=t)).split(':')
-            t = f'{h}:{m}:{float(s):.3f}'
-            return escape_chars(t, r"\'=:", r'\\')
-        cmd.append (
-                    ''.join([f'[{i}:v:0]scale=-1:{args.height}[a{i}];\
-[a{i}]drawtext=fontcolor={args.fontcolor}:fontfile={fontfile}:\
-fontsize={fontsize}:text={get_timestamp(seek + i*interval)}:x=text_h:y=text_h[b{i}];\
-[b{i}]format=rgba[c{i}];[c{i}]pad=iw+2*{pad}:ih+2*{pad}:{pad}:{pad}:color=#00000000[v{i}];' for i in range(c * r)]) 
-                    + ''.join([f'[v{i}]' for i in range(c * r)])
-                    + f'xstack=inputs={c * r}:layout='
-                    + '|'.join([f'{i * (width + pad * 2)}_{j * (height + pad * 2)}' for j in range(r) for i in range(c)])
-                    + '[c]')
-    else:
-        cmd.append (
-                    ''.join([f'[{i}:v:0]scale=-1:{args.height}[b{i}];\
-[b{i}]format=rgba[c{i}];[c{i}]pad=iw+2*{pad}:ih+2*{pad}:{pad}:{pad}:color=#00000000[v{i}];' for i in range(c * r)]) 
-                    + ''.join([f'[v{i}]' for i in range(c * r)])
-                    + f'xstack=inputs={c * r}:layout='
-                    + '|'.join([f'{i * (width + pad * 2)}_{j * (height + pad * 2)}' for j in range(r) for i in range(c)])
-                    + '[c]')
+    cmd.append(stack_filter([f'[{i}:v:0]' for i in range(c * r)], args, capture_info, scale=True))
         
     cmd.extend(['-map', '[c]'])
     cmd.extend(['-frames:v', '1'])
@@ -269,6 +365,10 @@ def capture_file_in_sequence(file:str, args, capture_info:dict) -> CaptureResult
     '''Captures a video according to arguments.
     To avoid memory shortage or when the command generated in capture_file_once is too long, 
     the task is accomplished by splitting the command to several sub commands.
+    
+    If the frame cache is enabled, the scaled frames are kept in the cache, and frames found 
+    there are reused without touching the video, so that changing the layout or the style of 
+    the timestamps only needs the stacking command to run.
     '''
     # Generating command
     output_name = capture_info['output_name']
@@ -276,21 +376,31 @@ def capture_file_in_sequence(file:str, args, capture_info:dict) -> CaptureResult
     interval = capture_info['interval']
     width, height = capture_info['width'], capture_info['height']
     c, r = capture_info['columns'], capture_info['rows']
-    pad = capture_info['pad']
-    fontsize = capture_info['fontsize']
 
+    frames = []
     tmp_files = []
     tmp_dir = tempfile.gettempdir()
+    cache_dir = args.cachedir if args.cache else None
 
     # Generating images
     for i in range(c * r):
-        captured = os.path.join(tmp_dir, f'{os.path.basename(output_name)}_{i}')
+        tmp_name = os.path.join(tmp_dir, f'{os.path.basename(output_name)}_{i}')
+        if cache_dir:
+            cached = get_cache_name(cache_dir, file, f'{seek + i * interval:.6f}', args.height) + '.png'
+            if os.path.isfile(cached):
+                LOGGER.debug(f'Using cached frame at {seek + i * interval:.3f}s.')
+                os.utime(cached)
+                frames.append(cached)
+                continue
+            captured = cached + '.part'
+        else:
+            captured = tmp_name
 
         cmd = [
             FFMPEG,
             '-ss', f'{seek + i * interval}',
             '-i', file,
-            '-filter_complex', f'[0:v:0]scale=-1:{args.height}[c]',
+            '-filter_complex', f'[0:v:0]scale=-1:{args.height},format=rgba[c]',
             '-map', '[c]',
             '-frames:v', '1',
             '-loglevel', 'error',
@@ -299,7 +409,7 @@ def capture_file_in_sequence(file:str, args, capture_info:dict) -> CaptureResult
             captured
         ]
 
-        if args.overwrite:
+        if args.overwrite or cache_dir:
             cmd.append('-y')
 
         retcode, _, err = run_async(cmd)
@@ -309,8 +419,16 @@ def capture_file_in_sequence(file:str, args, capture_info:dict) -> CaptureResult
                 f'{seek + i * interval:.3f}s. {suppress_log(err)}'
             )
 
+        if cache_dir and os.path.exists(captured):
+            if retcode == 0:
+                os.replace(captured, cached)
+                frames.append(cached)
+                continue
+            os.remove(captured)
+
         # FFmpeg may exit successfully without producing an output frame.
         if not os.path.exists(captured):
+            captured = tmp_name
             LOGGER.warning(
                 f'No frame captured at {seek + i * interval:.3f}s, '
                 f'using a transparent placeholder.'
@@ -339,35 +457,15 @@ def capture_file_in_sequence(file:str, args, capture_info:dict) -> CaptureResult
             )
             return CaptureResult.CAPTURE_ERROR_OCCURED
 
+        frames.append(captured)
         tmp_files.append(captured)
     
     # Generating stacking command
     cmd = [FFMPEG]
     for i in range(c * r):
-        cmd.extend(['-f', 'image2', '-i', tmp_files[i]])
+        cmd.extend(['-f', 'image2', '-i', frames[i]])
     cmd.append('-filter_complex')
-    if args.timestamp:
-        fontfile = escape_chars(FONTFILE, r"\' =:", r'\\')
-        def get_timestamp(t):
-            h, m, s = str(timedelta(seconds=t)).split(':')
-            t = f'{h}:{m}:{float(s):.3f}'
-            return escape_chars(t, r"\'=:", r'\\')
-        cmd.append (
-                    ''.join([f'[{i}]drawtext=fontcolor={args.fontcolor}:\
-fontfile={fontfile}:fontsize={fontsize}:text={get_timestamp(seek + i*interval)}:x=text_h:y=text_h[b{i}];\
-[b{i}]format=rgba[c{i}];[c{i}]pad=iw+2*{pad}:ih+2*{pad}:{pad}:{pad}:color=#00000000[v{i}];' for i in range(c * r)]) 
-                    + ''.join([f'[v{i}]' for i in range(c * r)])
-                    + f'xstack=inputs={c * r}:layout='
-                    + '|'.join([f'{i * (width + 2 * pad)}_{j * (height + 2 * pad)}' for j in range(r) for i in range(c)])
-                    + '[c]')
-    else:
-        cmd.append (
-                    ''.join([f'[{i}]format=rgba[c{i}];\
-[c{i}]pad=iw+2*{pad}:ih+2*{pad}:{pad}:{pad}:color=#00000000[v{i}];' for i in range(c * r)]) 
-                    + ''.join([f'[v{i}]' for i in range(c * r)])
-                    + f'xstack=inputs={c * r}:layout='
-                    + '|'.join([f'{i * (width + 2 * pad)}_{j * (height + 2 * pad)}' for j in range(r) for i in range(c)])
-                    + '[c]')
+    cmd.append(stack_filter([f'[{i}]' for i in range(c * r)], args, capture_info))
         
     cmd.extend(['-map', '[c]'])
     cmd.extend(['-loglevel', 'error'])
@@ -379,6 +477,8 @@ fontfile={fontfile}:fontsize={fontsize}:text={get_timestamp(seek + i*interval)}:
     retcode, _, err = run_async(cmd)
     
     [os.remove(f) for f in tmp_files if os.path.exists(f)]
+    if cache_dir:
+        prune_cache(cache_dir, args.cachesize * 1024 * 1024)
     if retcode != 0:
         if "already exists" in err and not args.overwrite:
             LOGGER.info("Output exists, skipping. Use -o/--overwrite to overwrite.")
@@ -398,6 +498,7 @@ def capture_file(file:str, args) -> tuple[str, CaptureResult]:
     
     The first way is more efficient when the file is small and the number of captures (c * r) is 
     small, but it is also more memory consuming. So this method chooses one of them to execute.
+    The second way is always used when the frame cache is enabled.
     '''
     if not os.path.isfile(file):
         LOGGER.error(f'Specified file {file} does not exist.')
@@ -405,7 +506,7 @@ def capture_file(file:str, args) -> tuple[str, CaptureResult]:
     
     # Probe file info.
     LOGGER.info('Probing...')
-    info = probe_file(file)
+    info = probe_file(file, args.cachedir if args.cache else None)
     if info is None:
         LOGGER.info('Failed to probe.')
         return file, CaptureResult.PROBE_FAILED
@@ -443,7 +544,10 @@ ratio: { info['width']} x {info['height']}, average frame rate: {info['avg_frame
     available_memory = psutil.virtual_memory().available / (1024 * 1024)
     
     # Select a method according to the file size and the current available memory
-    if available_memory * MEMORY_PARA  > (size * c * r):
+    if args.cache:
+        LOGGER.info('Capturing in splitted commands to use the frame cache...')
+        result = capture_file_in_sequence(file, args, capture_info)
+    elif available_memory * MEMORY_PARA  > (size * c * r):
         LOGGER.info('Trying to capture in one command...')
         cmd = capture_file_once_cmd(file, args, capture_info)
         sum = 0
@@ -483,9 +587,52 @@ def capture_multi(paths: list[str], args) -> Iterable[tuple[str, CaptureResult]]
     if n_skipped > 0:
         LOGGER.info('Skipped paths: ' + ', '.join(skpipped))
 
-    for i, pth in enumerate(targets, start=1):
-        LOGGER.info(f'\nHandling {i}/{n_targets}: {pth}')
-        yield capture_file(pth, args)
+    groups = group_duplicates(targets)
+    n_unique = len(groups)
+    if n_unique < n_targets:
+        LOGGER.info(f'Unique contents to capture: {n_unique}')
+
+    for i, (pth, duplicates) in enumerate(groups.items(), start=1):
+        LOGGER.info(f'\nHandling {i}/{n_unique}: {pth}')
+        output_name = get_output_name(pth, args.format)
+        if args.overwrite and os.path.isfile(output_name) and os.stat(output_name).st_nlink > 1:
+            # Do not write through a hardlink shared with the output of another video.
+            os.remove(output_name)
+        file, result = capture_file(pth, args)
+        yield file, result
+        for dup in duplicates:
+            LOGGER.info(f'Same content as {pth}: {dup}')
+            yield dup, share_capture(pth, dup, result, args)
+
+def share_capture(file:str, duplicate:str, result:CaptureResult, args) -> CaptureResult:
+    '''Reuse the output of a captured file for a file with identical content.
+    The output is hardlinked when possible and copied otherwise. It is created under a 
+    temporary name first, so an existing output is only replaced once that succeeded.
+    '''
+    src = get_output_name(file, args.format)
+    dst = get_output_name(duplicate, args.format)
+    if result not in (CaptureResult.SUCCEEDED, CaptureResult.SKIPPED) or not os.path.isfile(src):
+        return result
+    if src == dst or (os.path.exists(dst) and os.path.samefile(src, dst)):
+        return result
+    
+    tmp = dst + '.part'
+    try:
+        if os.path.lexists(tmp):
+            os.remove(tmp)
+        try:
+            os.link(src, tmp)
+        except OSError:
+            shutil.copy2(src, tmp)
+        os.replace(tmp, dst)
+    except OSError as e:
+        LOGGER.error(f'Failed to copy {src} to {dst}: {e}')
+        if os.path.lexists(tmp):
+            os.remove(tmp)
+        return CaptureResult.CAPTURE_ERROR_OCCURED
+    
+    LOGGER.info('Succeeded.')
+    return CaptureResult.SUCCEEDED
 
 def resolve_paths(patterns:list[str]) -> list[str]:
     paths = []
@@ -498,16 +645,23 @@ def collect_target_files(
         paths: list[str],
         args
     ) -> tuple[list[str], list[str]]:
-    """Collect target video files and skipped files."""
+    """Collect target video files and skipped files.
+    A file matched by several of the paths is collected only once.
+    """
 
     targets = []
     skipped = []
+    seen = set()
 
     def process_file(path: str):
         if not is_video(path):
             return
 
         path = os.path.abspath(path)
+        key = os.path.normcase(path)
+        if key in seen:
+            return
+        seen.add(key)
         output = get_output_name(path, args.format)
 
         if args.overwrite or not os.path.exists(output):
@@ -531,6 +685,65 @@ def collect_target_files(
 
     return targets, skipped
 
+def fingerprint_file(file:str, block_size=DEDUP_BLOCK_SIZE, samples=DEDUP_SAMPLES) -> str:
+    '''Cheap content fingerprint made of the file size and a hash of evenly sampled blocks.
+    Files no larger than block_size * samples are hashed entirely.
+    '''
+    size = os.path.getsize(file)
+    h = hashlib.blake2b(str(size).encode(), digest_size=16)
+    with open(file, 'rb') as f:
+        if size <= block_size * samples:
+            h.update(f.read())
+        else:
+            step = (size - block_size) // (samples - 1)
+            for i in range(samples):
+                f.seek(i * step)
+                h.update(f.read(block_size))
+    return h.hexdigest()
+
+def hash_file(file:str, block_size=1024 * 1024) -> str:
+    '''Full content hash of a file.'''
+    h = hashlib.blake2b(digest_size=16)
+    with open(file, 'rb') as f:
+        while chunk := f.read(block_size):
+            h.update(chunk)
+    return h.hexdigest()
+
+def group_duplicates(
+        files: list[str],
+        block_size=DEDUP_BLOCK_SIZE,
+        samples=DEDUP_SAMPLES
+    ) -> dict[str, list[str]]:
+    """Group files with identical content.
+    
+    Returns a dict mapping the first file of each content to the other files sharing it, 
+    in the order of the input. Files are compared by size first, then by sampled blocks, 
+    and only files whose samples collide are hashed entirely.
+    """
+    keys: dict[str, tuple] = {}
+    
+    def group_by(candidates, key_func):
+        buckets: dict[tuple, list[str]] = {}
+        for f in candidates:
+            try:
+                key = key_func(f)
+            except OSError as e:
+                LOGGER.warning(f'Failed to read {f}, treating it as unique: {e}')
+                key = ('unreadable', f)
+            keys[f] = key
+            buckets.setdefault(key, []).append(f)
+        return [b for b in buckets.values() if len(b) > 1]
+
+    for same_size in group_by(files, lambda f: (os.path.getsize(f),)):
+        for same_samples in group_by(same_size, lambda f: (*keys[f], fingerprint_file(f, block_size, samples))):
+            if keys[same_samples[0]][0] > block_size * samples:
+                group_by(same_samples, lambda f: (*keys[f], hash_file(f)))
+
+    groups: dict[tuple, list[str]] = {}
+    for f in files:
+        groups.setdefault(keys[f], []).append(f)
+    return {g[0]: g[1:] for g in groups.values()}
+
 def is_video(name: str) -> bool:
     return os.path.splitext(name.lower())[1] in VIDEO_EXT
 
@@ -634,6 +847,12 @@ def main():
             
         if args.fontratio < 0:
             args.fontratio = 0.08
+            
+        if args.cache:
+            if args.cachesize < 0:
+                LOGGER.error(f'Invalid argument "-z/--cachesize". Cache size {args.cachesize} invalid.')
+                sys.exit(1)
+            os.makedirs(args.cachedir, exist_ok=True)
     except Exception as e:
         LOGGER.error(f'Failed to parse arguments: {e}')
         sys.exit(1)
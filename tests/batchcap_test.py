@@ -1,7 +1,13 @@
 import unittest
 import subprocess
 import sys
+import tempfile
+import os
+import json
 from pathlib import Path
+from unittest import mock
+
+from batchcap import BatchCap
 
 ROOT = Path(__file__).parent.parent.resolve()
 TEST_DIR = Path(__file__).parent
@@ -61,6 +67,238 @@ class TestBatchCapCLI(unittest.TestCase):
         self.assertEqual(res.returncode, 0)
 
 
+class TempDirMixin:
+    """Provides a temporary directory as self.dir."""
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = Path(self.tmp.name)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _write(self, name, data):
+        path = self.dir / name
+        path.write_bytes(data)
+        return str(path)
+
+
+class TestGroupDuplicates(TempDirMixin, unittest.TestCase):
+    def test_identical_files(self):
+        """identical contents are grouped under the first file"""
+        a = self._write("a.mp4", b"0123456789" * 100)
+        b = self._write("b.mp4", b"abcdefghij" * 100)
+        c = self._write("c.mp4", b"0123456789" * 100)
+        groups = BatchCap.group_duplicates([a, b, c])
+        self.assertEqual(groups, {a: [c], b: []})
+
+    def test_sample_collision(self):
+        """files differing outside the sampled blocks are told apart by the full hash"""
+        data = bytearray(b"x" * 4096)
+        a = self._write("a.mp4", bytes(data))
+        data[1500] = ord("y")
+        b = self._write("b.mp4", bytes(data))
+        self.assertEqual(
+            BatchCap.fingerprint_file(a, block_size=16, samples=4),
+            BatchCap.fingerprint_file(b, block_size=16, samples=4),
+        )
+        groups = BatchCap.group_duplicates([a, b], block_size=16, samples=4)
+        self.assertEqual(groups, {a: [], b: []})
+
+
+class TestCaptureMulti(TempDirMixin, unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.a = self._write("a.mp4", b"0123456789" * 100)
+        self.b = self._write("b.mp4", b"0123456789" * 100)
+        self.c = self._write("c.mp4", b"abcdefghij" * 100)
+
+    def _capture(self, paths, *argv, result=BatchCap.CaptureResult.SUCCEEDED):
+        """Runs capture_multi with capture_file writing the file name as the output."""
+        def capture_file(file, args):
+            if result == BatchCap.CaptureResult.SUCCEEDED:
+                with open(BatchCap.get_output_name(file, args.format), "w") as f:
+                    f.write(os.path.basename(file))
+            return file, result
+
+        args = BatchCap.parser.parse_args(paths + list(argv))
+        with mock.patch.object(BatchCap, "capture_file", side_effect=capture_file) as capture:
+            output = list(BatchCap.capture_multi(paths, args))
+        return output, [call.args[0] for call in capture.call_args_list]
+
+    def _output(self, file):
+        return Path(BatchCap.get_output_name(file, "png"))
+
+    def test_hardlink(self):
+        """identical contents are captured once and the output is hardlinked"""
+        output, captured = self._capture([self.a, self.b, self.c])
+        self.assertEqual(captured, [self.a, self.c])
+        self.assertEqual(dict(output), dict.fromkeys([self.a, self.b, self.c], BatchCap.CaptureResult.SUCCEEDED))
+        self.assertTrue(os.path.samefile(self._output(self.a), self._output(self.b)))
+
+    def test_copy_fallback(self):
+        """the output is copied where hardlinks are not supported"""
+        with mock.patch.object(BatchCap.os, "link", side_effect=OSError("not supported")):
+            output, captured = self._capture([self.a, self.b])
+        self.assertEqual(captured, [self.a])
+        self.assertEqual(output[-1], (self.b, BatchCap.CaptureResult.SUCCEEDED))
+        self.assertFalse(os.path.samefile(self._output(self.a), self._output(self.b)))
+        self.assertEqual(self._output(self.b).read_text(), "a.mp4")
+
+    def test_overwrite_shared_output(self):
+        """overwriting does not write through an output hardlinked with another file"""
+        other = self._write("other.png", b"other")
+        os.link(other, self._output(self.c))
+        self._capture([self.c], "-o")
+        self.assertEqual(self._output(self.c).read_text(), "c.mp4")
+        self.assertEqual(Path(other).read_bytes(), b"other")
+
+    def test_failure(self):
+        """a failed capture is reported for the duplicates too"""
+        output, captured = self._capture([self.a, self.b], result=BatchCap.CaptureResult.CAPTURE_ERROR_OCCURED)
+        self.assertEqual(captured, [self.a])
+        self.assertEqual(dict(output), dict.fromkeys([self.a, self.b], BatchCap.CaptureResult.CAPTURE_ERROR_OCCURED))
+        self.assertFalse(self._output(self.b).exists())
+
+    def test_same_path(self):
+        """a file matched by several paths is captured once and its output is kept"""
+        output, captured = self._capture([self.a, self.a, str(self.dir)])
+        self.assertEqual(captured, [self.a, self.c])
+        self.assertEqual(sorted(file for file, _ in output), [self.a, self.b, self.c])
+        self.assertEqual(self._output(self.a).read_text(), "a.mp4")
+        args = BatchCap.parser.parse_args([self.a])
+        self.assertEqual(
+            BatchCap.share_capture(self.a, self.a, BatchCap.CaptureResult.SUCCEEDED, args),
+            BatchCap.CaptureResult.SUCCEEDED)
+        self.assertEqual(self._output(self.a).read_text(), "a.mp4")
+
+
+class TestCaptureCommand(unittest.TestCase):
+    def test_filtergraph(self):
+        """timestamps are drawn in the tile chains; padding is applied once to the sheet"""
+        args = BatchCap.parser.parse_args(["video.mp4", "-t", "3x2", "-i"])
+        capture_info = {
+            'seek': 0, 'output_name': 'video.mp4.cap.png', 'interval': 10.0,
+            'columns': 3, 'rows': 2, 'width': 480, 'height': 270, 'pad': 2, 'fontsize': 21,
+        }
+        cmd = BatchCap.capture_file_once_cmd("video.mp4", args, capture_info)
+        graph = cmd[cmd.index('-filter_complex') + 1]
+        tiles, sheet = graph.rsplit(';', 1)
+        for i, tile in enumerate(tiles.split(';')):
+            self.assertTrue(tile.startswith(f'[{i}:v:0]scale=-1:270,format=rgba,drawtext='))
+            self.assertTrue(tile.endswith(f':x=text_h:y=text_h[v{i}]'))
+        self.assertNotIn('drawtext', sheet)
+        self.assertEqual(sheet, '[v0][v1][v2][v3][v4][v5]xstack=inputs=6:'
+                         'layout=0_0|484_0|968_0|0_274|484_274|968_274:fill=#00000000,'
+                         'pad=iw+2*2:ih+2*2:2:2:color=#00000000[c]')
+
+    def test_filtergraph_sequence(self):
+        """frames captured in sequence are only timestamped before stacking"""
+        args = BatchCap.parser.parse_args(["video.mp4", "-t", "2x1"])
+        capture_info = {
+            'seek': 0, 'output_name': 'video.mp4.cap.png', 'interval': 10.0,
+            'columns': 2, 'rows': 1, 'width': 480, 'height': 270, 'pad': 0, 'fontsize': 21,
+        }
+        self.assertEqual(BatchCap.stack_filter(['[0]', '[1]'], args, capture_info),
+                         '[0][1]xstack=inputs=2:layout=0_0|480_0:fill=#00000000[c]')
+        args.timestamp = True
+        graph = BatchCap.stack_filter(['[0]', '[1]'], args, capture_info)
+        self.assertTrue(graph.startswith('[0]drawtext='))
+        self.assertTrue(graph.endswith('[v0][v1]xstack=inputs=2:layout=0_0|480_0:fill=#00000000[c]'))
+
+class TestCache(TempDirMixin, unittest.TestCase):
+    PROBE_OUTPUT = json.dumps({
+        'streams': [{'codec_type': 'video', 'avg_frame_rate': '25/1', 'r_frame_rate': '25/1',
+                     'width': 1280, 'height': 720}],
+        'format': {'duration': '60.0', 'size': '10'},
+    })
+
+    def setUp(self):
+        super().setUp()
+        self.video = self._write("video.mp4", b"0" * 10)
+        self.cache = self.dir / "cache"
+        self.cache.mkdir()
+        self.args = BatchCap.parser.parse_args([self.video, "-t", "2x1", "-i", "-k", "-d", str(self.cache)])
+        self.capture_info = {
+            'seek': 0, 'output_name': str(self.dir / "video.mp4.cap.png"), 'interval': 5.0,
+            'columns': 2, 'rows': 1, 'width': 480, 'height': 270, 'pad': 2, 'fontsize': 21,
+        }
+
+    def _frame(self, t):
+        return BatchCap.get_cache_name(str(self.cache), self.video, f"{t:.6f}", 270) + ".png"
+
+    def _cache_entries(self):
+        return sorted(p.name for p in self.cache.iterdir())
+
+    def test_cache_name(self):
+        """cache entries are invalidated when the source file changes"""
+        name = BatchCap.get_cache_name(str(self.cache), self.video, "1.000000", 270)
+        self.assertEqual(name, BatchCap.get_cache_name(str(self.cache), self.video, "1.000000", 270))
+        self.assertNotEqual(name, BatchCap.get_cache_name(str(self.cache), self.video, "1.000000", 360))
+        Path(self.video).write_bytes(b"0" * 11)
+        self.assertNotEqual(name, BatchCap.get_cache_name(str(self.cache), self.video, "1.000000", 270))
+
+    def test_prune_cache(self):
+        """least recently used entries are evicted first, other files are left alone"""
+        entries = [f"{i:032x}.png" for i in range(3)]
+        for i, name in enumerate([entries[1], entries[0], entries[2], f"{3:032x}.png.part", "notes.txt"]):
+            path = self.cache / name
+            path.write_bytes(b"0" * 100)
+            os.utime(path, (i, i))
+        BatchCap.prune_cache(str(self.cache), 150)
+        self.assertEqual(self._cache_entries(), [entries[2], f"{3:032x}.png.part", "notes.txt"])
+
+    def test_cached_frames(self):
+        """a re-layout with all frames cached only runs the stacking command"""
+        frames = [self._frame(0), self._frame(5)]
+        for frame in frames:
+            Path(frame).write_bytes(b"png")
+        with mock.patch.object(BatchCap, "run_async", return_value=(0, "", "")) as run:
+            result = BatchCap.capture_file_in_sequence(self.video, self.args, self.capture_info)
+        self.assertEqual(result, BatchCap.CaptureResult.SUCCEEDED)
+        self.assertEqual(run.call_count, 1)
+        cmd = run.call_args.args[0]
+        self.assertNotIn(self.video, cmd)
+        self.assertNotIn("-ss", cmd)
+        self.assertEqual([cmd[i + 1] for i, arg in enumerate(cmd) if arg == "-i"], frames)
+        self.assertTrue(all(os.path.exists(frame) for frame in frames))
+
+    def test_failed_frame(self):
+        """frames that failed to be extracted are not cached"""
+        def run_async(cmd):
+            if "-ss" in cmd and cmd[cmd.index("-ss") + 1] == "5.0":
+                Path(cmd[-2]).write_bytes(b"partial")
+                return 1, "", "error"
+            if "-ss" in cmd or "lavfi" in cmd:
+                Path(cmd[-2] if cmd[-1] == "-y" else cmd[-1]).write_bytes(b"png")
+            return 0, "", ""
+
+        with mock.patch.object(BatchCap, "run_async", side_effect=run_async):
+            result = BatchCap.capture_file_in_sequence(self.video, self.args, self.capture_info)
+        self.assertEqual(result, BatchCap.CaptureResult.SUCCEEDED)
+        self.assertEqual(self._cache_entries(), [os.path.basename(self._frame(0))])
+
+    def test_probe_cache(self):
+        """probe results are cached until the source file changes"""
+        with mock.patch.object(BatchCap, "run_async", return_value=(0, self.PROBE_OUTPUT, "")) as run:
+            info = BatchCap.probe_file(self.video, str(self.cache))
+            self.assertEqual(BatchCap.probe_file(self.video, str(self.cache)), info)
+            self.assertEqual(run.call_count, 1)
+            Path(self.video).write_bytes(b"0" * 11)
+            BatchCap.probe_file(self.video, str(self.cache))
+            self.assertEqual(run.call_count, 2)
+        self.assertEqual(info['width'], 1280)
+        self.assertEqual(info['duration'], 60.0)
+
+    def test_broken_probe_cache(self):
+        """a truncated probe cache entry is treated as a miss and rewritten"""
+        cached = Path(BatchCap.get_cache_name(str(self.cache), self.video, 'probe') + '.json')
+        cached.write_text('{"avg_frame_rate": 25.0, "wid')
+        with mock.patch.object(BatchCap, "run_async", return_value=(0, self.PROBE_OUTPUT, "")) as run:
+            info = BatchCap.probe_file(self.video, str(self.cache))
+        self.assertEqual(run.call_count, 1)
+        self.assertEqual(json.loads(cached.read_text()), info)
+        self.assertFalse(Path(str(cached) + '.part').exists())
+
 if __name__ == "__main__":
     unittest.main()
     
\ No newline at end of file